@@ -1,76 +1,268 @@
 # mass_shootings_app.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
-from io import StringIO
+import plotly.io as pio
+from io import BytesIO
 
-st.set_page_config(page_title="US Mass Shootings Analysis", layout="wide")
+MJ_COLUMNS = ['Date', 'State', 'School']
+GVA_COLUMNS = ['Incident Date', 'State', 'School']
 
-st.title("U.S. Mass Shootings — Hybrid MJ + GVA")
+US_STATES = pd.CategoricalDtype(categories=[
+    'Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado', 'Connecticut',
+    'Delaware', 'District of Columbia', 'Florida', 'Georgia', 'Hawaii', 'Idaho', 'Illinois',
+    'Indiana', 'Iowa', 'Kansas', 'Kentucky', 'Louisiana', 'Maine', 'Maryland', 'Massachusetts',
+    'Michigan', 'Minnesota', 'Mississippi', 'Missouri', 'Montana', 'Nebraska', 'Nevada',
+    'New Hampshire', 'New Jersey', 'New Mexico', 'New York', 'North Carolina', 'North Dakota',
+    'Ohio', 'Oklahoma', 'Oregon', 'Pennsylvania', 'Rhode Island', 'South Carolina',
+    'South Dakota', 'Tennessee', 'Texas', 'Utah', 'Vermont', 'Virginia', 'Washington',
+    'West Virginia', 'Wisconsin', 'Wyoming',
+], ordered=False)
 
-st.markdown("""
-This app allows you to upload **Mother Jones (MJ)** and **Gun Violence Archive (GVA)** CSVs, aggregates mass shootings by **Year × State**, marks **school shootings**, and displays tables and charts.
-""")
+# Postal codes in US_STATES order, for plotly's locationmode='USA-states'
+US_STATE_CODES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN',
+    'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH',
+    'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT',
+    'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+]
+STATE_CODE_BY_NAME = dict(zip(US_STATES.categories, US_STATE_CODES))
 
-# ----------------------------------------
-# 1️⃣ Upload CSVs
-# ----------------------------------------
-mj_file = st.file_uploader("Upload Mother Jones CSV", type=["csv"])
-gva_file = st.file_uploader("Upload GVA CSV", type=["csv"])
 
-if mj_file and gva_file:
+def read_incidents(csv_file, columns):
+    """Read only the columns we aggregate on, using the PyArrow CSV parser.
+
+    'School' is optional in both sources, so the header is peeked first and
+    the projection is limited to the columns actually present.
+    """
+    header = pd.read_csv(csv_file, nrows=0).columns
+    csv_file.seek(0)
+    return pd.read_csv(csv_file, engine='pyarrow', usecols=[c for c in columns if c in header])
+
+
+def encode_states(df):
+    """Strip State and dictionary-encode it against US_STATES, in place.
+
+    Names not in the list become NaN; returns how many there were.
+    """
+    state = df['State'].astype('string').str.strip()
+    known = state.isin(US_STATES.categories)
+    df['State'] = state.where(known).astype(US_STATES)
+    return int((state.notna() & ~known).sum())
+
+
+def rows(n):
+    """'1 row' / 'n rows', for the dropped-row notes."""
+    return f"{n} row" if n == 1 else f"{n} rows"
+
+
+def parse_dates(dates, fmt):
+    """Parse dates with the source's usual format, falling back to inference.
+
+    The fixed format takes pandas' fast path; only the values it rejects are
+    retried with format='mixed'. Anything still unparseable is NaT.
+    """
+    parsed = pd.to_datetime(dates, format=fmt, errors='coerce', cache=True)
+    retry = parsed.isna() & dates.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(dates[retry], format='mixed', errors='coerce')
+    return parsed
+
+
+def school_flags(df):
+    """The School column as bool, or None if it is not bool/numeric.
+
+    Any non-zero number counts as a school incident. A missing column means
+    no school incidents; text values such as "Yes"/"No" are not interpreted.
+    """
+    if 'School' not in df:
+        return pd.Series(False, index=df.index)
+    school = df['School']
+    kind = pd.api.types.infer_dtype(school, skipna=True)
+    if kind not in ('boolean', 'integer', 'floating', 'mixed-integer-float', 'empty'):
+        return None
+    # notna() first: astype(bool) on its own would turn NaN into True
+    return school.notna() & school.astype(bool)
+
+
+def count_cells(df, first_year, n_years):
+    """Incident and school-incident counts for every (Year, State) cell.
+
+    Returns two flat arrays laid out year-major, matching
+    MultiIndex.from_product([years, US_STATES.categories]). Rows with no
+    State code (missing, or not in US_STATES; encode_states counts the
+    latter) are skipped.
+    """
+    n_states = len(US_STATES.categories)
+    years = df['Year'].to_numpy(dtype=np.intp)
+    codes = df['State'].cat.codes.to_numpy(dtype=np.intp)
+    school = df['School'].to_numpy(dtype=bool)
+    cell = (years - first_year) * n_states + codes
+    known = codes >= 0
+    if not known.all():
+        cell, school = cell[known], school[known]
+    size = n_years * n_states
+    return np.bincount(cell, minlength=size), np.bincount(cell[school], minlength=size)
+
+
+@st.cache_data
+def load_and_aggregate(mj_bytes, gva_bytes):
+    """Parse both uploads and build the Year × State table and national trend.
+
+    Takes the raw file contents so Streamlit can memoize on them; widget
+    reruns with the same uploads return the cached frames. Also returns a
+    list of messages about rows that had to be dropped.
+    """
+    notes = []
+
     # Load CSVs
-    mj_df = pd.read_csv(mj_file)
-    gva_df = pd.read_csv(gva_file)
+    mj_df = read_incidents(BytesIO(mj_bytes), MJ_COLUMNS)
+    gva_df = read_incidents(BytesIO(gva_bytes), GVA_COLUMNS)
 
     # ----------------------------------------
     # 2️⃣ Parse & normalize
     # ----------------------------------------
     # MJ
-    mj_df['Date'] = pd.to_datetime(mj_df['Date'], errors='coerce')
-    mj_df['Year'] = mj_df['Date'].dt.year
-    mj_df['School'] = mj_df.get('School', False)
-    mj_df['MJ_Count'] = 1
+    mj_df['Date'] = parse_dates(mj_df['Date'], '%m/%d/%Y')
+    n_bad = int(mj_df['Date'].isna().sum())
+    if n_bad:
+        notes.append(f"MJ: {rows(n_bad)} with an unparseable Date dropped")
+    mj_df = mj_df.dropna(subset=['Date'])
+    # Counted after the date drop so each dropped row is reported once
+    n_unknown = encode_states(mj_df)
+    if n_unknown:
+        notes.append(f"MJ: {rows(n_unknown)} with unrecognised State dropped")
+    mj_df['Year'] = mj_df['Date'].dt.year.astype('int16')
+    school = school_flags(mj_df)
+    if school is None:
+        notes.append("MJ: School column is not boolean or numeric; school incidents not counted")
+        school = False
+    mj_df['School'] = school
 
     # GVA
-    gva_df['Incident Date'] = pd.to_datetime(gva_df['Incident Date'], errors='coerce')
-    gva_df['Year'] = gva_df['Incident Date'].dt.year
-    gva_df['School'] = gva_df.get('School', False)
-    gva_df['GVA_Count'] = 1
+    gva_df = gva_df.rename(columns={'Incident Date': 'Date'})
+    gva_df['Date'] = parse_dates(gva_df['Date'], '%B %d, %Y')
+    n_bad = int(gva_df['Date'].isna().sum())
+    if n_bad:
+        notes.append(f"GVA: {rows(n_bad)} with an unparseable Incident Date dropped")
+    gva_df = gva_df.dropna(subset=['Date'])
+    n_unknown = encode_states(gva_df)
+    if n_unknown:
+        notes.append(f"GVA: {rows(n_unknown)} with unrecognised State dropped")
+    gva_df['Year'] = gva_df['Date'].dt.year.astype('int16')
+    school = school_flags(gva_df)
+    if school is None:
+        notes.append("GVA: School column is not boolean or numeric; school incidents not counted")
+        school = False
+    gva_df['School'] = school
 
     # ----------------------------------------
     # 3️⃣ Aggregate Year × State
     # ----------------------------------------
-    mj_agg = mj_df.groupby(['Year','State']).agg(
-        MJ_Count=('MJ_Count','sum'),
-        School_Incidents=('School','sum')
-    ).reset_index()
+    # Each source is counted with bincount onto a dense Year × State grid,
+    # so there is no hash groupby and no join between the two sources.
+    years = np.concatenate([mj_df['Year'].to_numpy(), gva_df['Year'].to_numpy()])
+    if years.size == 0:
+        # An empty year range makes every frame below come out empty
+        notes.append("Neither upload has a row with a parseable date; nothing to show")
+        first_year, last_year = 0, -1
+    else:
+        first_year, last_year = int(years.min()), int(years.max())
+    n_years = last_year - first_year + 1
+    mj_count, mj_school = count_cells(mj_df, first_year, n_years)
+    gva_count, gva_school = count_cells(gva_df, first_year, n_years)
 
-    gva_agg = gva_df.groupby(['Year','State']).agg(
-        GVA_Count=('GVA_Count','sum'),
-        School_Incidents=('School','sum')
-    ).reset_index()
+    cells = pd.MultiIndex.from_product(
+        [np.arange(first_year, last_year + 1, dtype='int16'),
+         pd.CategoricalIndex(US_STATES.categories, dtype=US_STATES)],
+        names=['Year','State']
+    )
+    combined = pd.DataFrame({
+        'MJ_Count': mj_count.astype(np.int32),
+        'GVA_Count': gva_count.astype(np.int32),
+        'School_Incidents_MJ': mj_school.astype(np.int32),
+        'School_Incidents_GVA': gva_school.astype(np.int32),
+    }, index=cells)
+    # Keep only cells with at least one incident, as the groupby did
+    combined = combined[(mj_count + gva_count) > 0].reset_index()
+
+    # Kept as bool; the ★ marker is only applied when the table is rendered
+    combined['School'] = (combined['School_Incidents_MJ'] > 0) | (combined['School_Incidents_GVA'] > 0)
+
+    # National totals per year, for the trend chart
+    national_trend = (
+        combined.groupby('Year', sort=True)[['MJ_Count','GVA_Count']].sum()
+        .rename(columns={'MJ_Count':'MJ_Total','GVA_Count':'GVA_Total'})
+        .reset_index()
+    )
 
-    combined = pd.merge(
-        mj_agg, gva_agg, on=['Year','State'], how='outer', suffixes=('_MJ','_GVA')
-    ).fillna(0)
+    # Per-state totals over all years, for the choropleth
+    state_totals = (
+        combined.groupby('State', observed=True)[['MJ_Count','GVA_Count']].sum()
+        .reset_index()
+    )
+    state_totals['Total'] = state_totals['MJ_Count'] + state_totals['GVA_Count']
+    state_totals['Code'] = state_totals['State'].astype(str).map(STATE_CODE_BY_NAME)
+
+    return combined, national_trend, state_totals, notes
 
-    combined['School'] = combined.apply(lambda row: '★' if row['School_Incidents_MJ']>0 or row['School_Incidents_GVA']>0 else '', axis=1)
+
+def state_map_figure(state_totals):
+    """Choropleth of MJ + GVA incident totals per state."""
+    return px.choropleth(
+        state_totals,
+        locations='Code',
+        locationmode='USA-states',
+        color='Total',
+        scope='usa',
+        hover_name='State',
+        hover_data=['MJ_Count','GVA_Count'],
+        labels={'Total':'MJ + GVA incidents (total)'}
+    )
+
+
+@st.cache_data
+def figure_to_png(fig_json):
+    """Export a plotly figure (as JSON) to PNG bytes, cached per figure.
+
+    A static image means the browser never fetches plotly.js or the US
+    topojson. Raises RuntimeError if kaleido or its Chrome is not installed.
+    """
+    return pio.from_json(fig_json).to_image(format='png', width=800, height=400)
+
+
+st.set_page_config(page_title="US Mass Shootings Analysis", layout="wide")
+
+st.title("U.S. Mass Shootings — Hybrid MJ + GVA")
+
+st.markdown("""
+This app allows you to upload **Mother Jones (MJ)** and **Gun Violence Archive (GVA)** CSVs, aggregates mass shootings by **Year × State**, marks **school shootings**, and displays tables and charts.
+""")
+
+# ----------------------------------------
+# 1️⃣ Upload CSVs
+# ----------------------------------------
+mj_file = st.file_uploader("Upload Mother Jones CSV", type=["csv"])
+gva_file = st.file_uploader("Upload GVA CSV", type=["csv"])
+
+if mj_file and gva_file:
+    combined, national_trend, state_totals, notes = load_and_aggregate(mj_file.getvalue(), gva_file.getvalue())
+    for note in notes:
+        st.warning(note)
+    if combined.empty:
+        st.stop()
 
     # ----------------------------------------
     # 4️⃣ Display Table
     # ----------------------------------------
     st.subheader("State × Year Mass Shootings Table")
-    st.dataframe(combined[['Year','State','MJ_Count','GVA_Count','School']])
+    table = combined[['Year','State','MJ_Count','GVA_Count','School']]
+    st.dataframe(table.assign(School=np.where(table['School'], '★', '')))
 
     # ----------------------------------------
     # 5️⃣ National Trend Chart
     # ----------------------------------------
-    national_trend = combined.groupby('Year').agg(
-        MJ_Total=('MJ_Count','sum'),
-        GVA_Total=('GVA_Count','sum')
-    ).reset_index()
-
     fig = px.line(
         national_trend,
         x='Year',
@@ -82,11 +274,15 @@ if mj_file and gva_file:
     st.plotly_chart(fig, use_container_width=True)
 
     # ----------------------------------------
-    # 6️⃣ Optional: U.S. Map Placeholder
+    # 6️⃣ U.S. Map
     # ----------------------------------------
-    st.subheader("U.S. Map — Mass Shooting Density by State (Placeholder)")
-    st.image("https://via.placeholder.com/800x400?text=State+Mass+Shooting+Map+Placeholder")
-    st.markdown("Replace with dynamic choropleth once full state-level data is available.")
+    st.subheader("U.S. Map — MJ + GVA Incidents by State (total)")
+    map_fig = state_map_figure(state_totals)
+    try:
+        st.image(figure_to_png(map_fig.to_json()))
+    except RuntimeError:
+        # No kaleido/Chrome on this server; let the browser draw the map
+        st.plotly_chart(map_fig, use_container_width=True)
 
 else:
     st.info("Upload both Mother Jones and GVA CSV files to proceed.")